@@ -0,0 +1,101 @@
+# Imports
+import argparse
+import asyncio
+import databases
+import os
+import sqlite3
+import sys
+import time
+import toml
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from schema import prepare_shard, write_transaction
+
+# Move finished games and their guesses from the games and guesses tables to games_archive and guesses_archive,
+# keeping the tables and indexes used by in-progress games small. The game service looks up archived games and
+# counts them in the statistics on its own.
+
+# Finished games due for the archive, oldest first
+DUE_GAMES = """
+    SELECT game_id FROM games
+    WHERE finished_at < :cutoff
+    ORDER BY finished_at
+    LIMIT :batch_size
+"""
+
+
+# Establish database connection.
+async def _get_db(url):
+    db = databases.Database(url)
+    await db.connect()
+    return db
+
+
+async def archive_batch(db, cutoff, batch_size):
+    values = {"cutoff": cutoff, "batch_size": batch_size}
+    columns = [column["name"] for column in await db.fetch_all("PRAGMA table_info(games_archive)")]
+    column_list = ", ".join(columns)
+
+    # take the write lock before counting, game writes between the count and the inserts would fail the batch
+    async with write_transaction(db):
+        count = await db.fetch_val(f"SELECT count(*) FROM ({DUE_GAMES})", values=values)
+        if count:
+            await db.execute(
+                f"INSERT INTO games_archive({column_list}) SELECT {column_list} FROM games WHERE game_id IN ({DUE_GAMES})",
+                values=values
+            )
+            await db.execute(
+                f"""
+                INSERT INTO guesses_archive(game_id, valid_word_id, guess_number)
+                SELECT game_id, valid_word_id, guess_number FROM guesses WHERE game_id IN ({DUE_GAMES})
+                """,
+                values=values
+            )
+            await db.execute(f"DELETE FROM guesses WHERE game_id IN ({DUE_GAMES})", values=values)
+            await db.execute(f"DELETE FROM games WHERE game_id IN ({DUE_GAMES})", values=values)
+    return count
+
+
+async def archive_shard(url, archive):
+    db = await _get_db(url)
+    try:
+        await prepare_shard(db)
+
+        cutoff = int(time.time()) - archive["AGE_HOURS"] * 3600
+        archived = 0
+        while True:
+            count = await archive_batch(db, cutoff, archive["BATCH_SIZE"])
+            archived += count
+            if count < archive["BATCH_SIZE"]:
+                break
+            # let waiting game writes take the lock between batches
+            await asyncio.sleep(archive["PAUSE_MS"] / 1000)
+
+        remaining = await db.fetch_val("SELECT count(*) FROM games")
+        total = await db.fetch_val("SELECT count(*) FROM games_archive")
+    finally:
+        await db.disconnect()
+    print(f"{url}: archived {archived} games, {remaining} games left in games, {total} in games_archive")
+
+
+async def archive_all(config, once):
+    archive = config["ARCHIVE"]
+    while True:
+        for shard in config["SHARDS"]:
+            try:
+                await archive_shard(shard["PRIMARY_GAME_URL"], archive)
+            except sqlite3.OperationalError as e:
+                # e.g. the database stayed locked longer than the busy timeout, the next pass picks up from here
+                print(f"{shard['PRIMARY_GAME_URL']}: archiving failed, retrying next pass: {e}", file=sys.stderr)
+        if once:
+            break
+        await asyncio.sleep(archive["INTERVAL_SECONDS"])
+
+
+# Run when executed as script.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move finished games to the archive tables")
+    parser.add_argument("--once", action="store_true", help="archive once instead of every INTERVAL_SECONDS")
+    args = parser.parse_args()
+
+    asyncio.run(archive_all(toml.load("./etc/wordle.toml"), args.once))
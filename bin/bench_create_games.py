@@ -0,0 +1,52 @@
+# Imports
+import argparse
+import asyncio
+import time
+import httpx
+
+# Compare games created per second by POST /games and POST /games/batch on a running game service.
+
+
+async def bench_single(client, games, concurrency):
+    async def create(count):
+        for _ in range(count):
+            response = await client.post("/games")
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(create(games // concurrency) for _ in range(concurrency)))
+    return (games // concurrency * concurrency) / (time.perf_counter() - start)
+
+
+async def bench_batch(client, games, batch_size, concurrency):
+    async def create(count):
+        for _ in range(count):
+            response = await client.post("/games/batch", json={"count": batch_size})
+            response.raise_for_status()
+
+    requests = games // batch_size // concurrency
+    start = time.perf_counter()
+    await asyncio.gather(*(create(requests) for _ in range(concurrency)))
+    return (requests * batch_size * concurrency) / (time.perf_counter() - start)
+
+
+async def main(args):
+    auth = tuple(args.auth.split(":", 1))
+    async with httpx.AsyncClient(base_url=args.url, auth=auth, timeout=60) as client:
+        single = await bench_single(client, args.games, args.concurrency)
+        print(f"POST /games:       {single:,.0f} games/s")
+        batch = await bench_batch(client, args.games, args.batch, args.concurrency)
+        print(f"POST /games/batch: {batch:,.0f} games/s ({args.batch} games per request)")
+
+
+# Run when executed as script.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark single against batched game creation")
+    parser.add_argument("--url", default="http://tuffix-vm")
+    parser.add_argument("--auth", default="dummy:abc", help="username:password of a registered user")
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=100, help="games per POST /games/batch")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,57 @@
+# Imports
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from game_key import new_game_key
+
+# Compare insert rate and database size of uuid and ulid game keys on a scratch copy of the games schema.
+
+
+def create_db(path):
+    db = sqlite3.connect(path)
+    for script in ("./share/words.sql", "./share/games.sql"):
+        with open(script) as f:
+            db.executescript(f.read())
+    # the word tables are left empty, and the game service doesn't enable foreign keys either
+    db.execute("PRAGMA foreign_keys=OFF")
+    return db
+
+
+def run(id_format, games, guesses_per_game, batch_size):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "games.db")
+        db = create_db(path)
+
+        start = time.perf_counter()
+        for offset in range(0, games, batch_size):
+            rows = [(new_game_key(id_format), f"user{random.randint(1, 1000)}", random.randint(1, 2000))
+                    for _ in range(min(batch_size, games - offset))]
+            with db:
+                db.executemany("INSERT INTO games(game_id, username, secret_word_id) VALUES(?, ?, ?)", rows)
+                db.executemany(
+                    "INSERT INTO guesses(game_id, valid_word_id, guess_number) VALUES(?, ?, ?)",
+                    [(row[0], random.randint(1, 10000), n) for row in rows for n in range(1, guesses_per_game + 1)]
+                )
+        elapsed = time.perf_counter() - start
+        db.close()
+
+        return games / elapsed, os.path.getsize(path)
+
+
+# Run when executed as script.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark uuid against ulid game keys")
+    parser.add_argument("--games", type=int, default=200000)
+    parser.add_argument("--guesses", type=int, default=3, help="guesses inserted per game")
+    parser.add_argument("--batch", type=int, default=1000, help="games per transaction")
+    args = parser.parse_args()
+
+    for id_format in ("uuid", "ulid"):
+        rate, size = run(id_format, args.games, args.guesses, args.batch)
+        print(f"{id_format}: {rate:,.0f} games/s, database size {size / 1024 / 1024:.1f} MiB")
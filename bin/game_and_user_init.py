@@ -5,11 +5,15 @@ import databases
 import toml
 from quart import Quart
 from quart_schema import QuartSchema
-import uuid
 import hashlib
 import secrets
 import base64
-import itertools
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from shard import ShardRing
+from game_key import new_game_key
 
 # Encryption type.
 ALGORITHM = "pbkdf2_sha256"
@@ -19,14 +23,13 @@ app = Quart(__name__)
 QuartSchema(app)
 app.config.from_file(f"../etc/wordle.toml", toml.load)
 
-db_list = ['PRIMARY_GAME_URL', 'SECONDARY_GAME_URL', 'TERTIARY_GAME_URL']
-iterator = itertools.cycle(db_list)
+shards = ShardRing(app.config["SHARDS"])
 
 
-# Establish database connection for games
+# Establish database connection for games on the user's shard
 
-async def _get_game_write_db():
-    db = databases.Database(app.config["DATABASES"]["PRIMARY_GAME_URL"])
+async def _get_game_write_db(username):
+    db = databases.Database(shards.primary_url(shards.shard_for(username)))
     await db.connect()
     return db
 
@@ -40,7 +43,7 @@ async def _get_user_db():
 
 # insert into query for games and guesses table
 async def insert_into_games_sql(username):
-    write_db = await _get_game_write_db()
+    write_db = await _get_game_write_db(username)
 
     correct_words_result = await write_db.fetch_one(
         """
@@ -57,15 +60,15 @@ async def insert_into_games_sql(username):
     )
     valid_words_count = valid_words_result.count
 
-    uuid1 = str(uuid.uuid4())
+    game_key = new_game_key(app.config.get("GAMES", {}).get("ID_FORMAT", "uuid"))
     
     # 1
     await write_db.execute(
         """
         INSERT INTO games(game_id, username, secret_word_id)
-        VALUES(:uuid, :users, :secret_word_id)
+        VALUES(:game_id, :users, :secret_word_id)
         """, 
-        values={"uuid": uuid1, "users": username, "secret_word_id": random.randint(1, correct_words_count)}
+        values={"game_id": game_key, "users": username, "secret_word_id": random.randint(1, correct_words_count)}
     )
 
     await write_db.execute(
@@ -73,7 +76,7 @@ async def insert_into_games_sql(username):
         INSERT INTO guesses(game_id, valid_word_id, guess_number)
         VALUES(:game_id, :valid_word_id, :guess_number)
         """,
-        values={"game_id": uuid1, "valid_word_id": random.randint(1, valid_words_count), "guess_number": 1}
+        values={"game_id": game_key, "valid_word_id": random.randint(1, valid_words_count), "guess_number": 1}
     )
 
 
@@ -1,19 +1,28 @@
 # Create a database user.db and exit after creating it
 sqlite3 ./var/user.db  < ./share/users.sql
 
-# Create tables to store words
-sqlite3 ./var/primary/mount/games.db ".exit"
+# Primary database of every shard listed in etc/wordle.toml
+GAME_DBS=$(python3 ./shard.py)
 
-sqlite3 ./var/primary/mount/games.db  < ./share/words.sql
+# Create tables to store words
+for db in $GAME_DBS; do
+    sqlite3 $db ".exit"
+    sqlite3 $db  < ./share/words.sql
+done
 
 # insert values in valid_words and correct_words tables from json files
 python3 ./bin/word_init.py
 
-# create other tables required for storing user information and playing the wordle game
-sqlite3 ./var/primary/mount/games.db  < ./share/games.sql
+for db in $GAME_DBS; do
+    # create other tables required for storing user information and playing the wordle game
+    sqlite3 $db  < ./share/games.sql
+
+    # create the tables finished games are archived to
+    sqlite3 $db  < ./share/games_archive.sql
 
-# create other tables required for storing call back urls
-sqlite3 ./var/primary/mount/games.db < ./share/callback_urls.sql
+    # create other tables required for storing call back urls
+    sqlite3 $db < ./share/callback_urls.sql
+done
 
 # populate the user and games table with dummy values
 python3 ./bin/game_and_user_init.py
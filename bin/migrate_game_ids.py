@@ -0,0 +1,69 @@
+# Imports
+import asyncio
+import databases
+import os
+import sys
+import time
+import toml
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from shard import sqlite_path
+from game_key import new_ulid
+from schema import prepare_shard, write_transaction
+
+# Convert the uuid4 game keys of every shard into ULIDs, in the order the games were created, then VACUUM so the
+# primary key and guess indexes are rebuilt densely. Archived games are converted too. Set ID_FORMAT = 'ulid' in
+# etc/wordle.toml before running it so new games get ULIDs too. Games created before the migration get new public
+# ids, their old ids are kept in game_id_aliases so clients holding them can go on playing.
+
+
+# Establish database connection.
+async def _get_db(url):
+    db = databases.Database(url)
+    await db.connect()
+    return db
+
+
+def _file_size(url):
+    path = sqlite_path(url)
+    return os.path.getsize(path) + (os.path.getsize(path + "-wal") if os.path.exists(path + "-wal") else 0)
+
+
+async def migrate_shard(url):
+    db = await _get_db(url)
+    await prepare_shard(db)
+    size_before = _file_size(url)
+
+    timestamp_ms = int(time.time() * 1000)
+    converted = 0
+
+    start = time.perf_counter()
+    async with write_transaction(db):
+        # archived games were created before the ones still in games
+        for games_table, guesses_table in (("games_archive", "guesses_archive"), ("games", "guesses")):
+            games = await db.fetch_all(
+                f"SELECT game_id FROM {games_table} WHERE typeof(game_id) = 'text' ORDER BY rowid"
+            )
+            keys = [{"old": game_id, "new": new_ulid(timestamp_ms)} for (game_id,) in games]
+            await db.execute_many(
+                "INSERT OR REPLACE INTO game_id_aliases(old_game_id, game_id) VALUES(:old, :new)", keys
+            )
+            await db.execute_many(f"UPDATE {guesses_table} SET game_id=:new WHERE game_id=:old", keys)
+            await db.execute_many(f"UPDATE {games_table} SET game_id=:new WHERE game_id=:old", keys)
+            converted += len(keys)
+    elapsed = time.perf_counter() - start
+
+    await db.execute("VACUUM")
+    size_after = _file_size(url)
+    await db.disconnect()
+
+    print(f"{url}: converted {converted} games in {elapsed:.2f}s, "
+          f"database size {size_before / 1024:.0f} KiB -> {size_after / 1024:.0f} KiB")
+
+
+# Run when executed as script.
+if __name__ == "__main__":
+    config = toml.load("./etc/wordle.toml")
+    for shard in config["SHARDS"]:
+        asyncio.run(migrate_shard(shard["PRIMARY_GAME_URL"]))
+    print("Migration of game ids complete")
@@ -0,0 +1,54 @@
+# Imports
+import asyncio
+import databases
+import struct
+import toml
+
+# Copy the guesses table of every shard into the packed games.guess_history column, adding the column to
+# databases created before it existed. Set GUESS_STORAGE = 'packed' in etc/wordle.toml afterwards.
+
+
+# Establish database connection.
+async def _get_db(url):
+    db = databases.Database(url)
+    await db.connect()
+    return db
+
+
+async def migrate_shard(url):
+    db = await _get_db(url)
+
+    columns = await db.fetch_all("PRAGMA table_info(games)")
+    if "guess_history" not in [column["name"] for column in columns]:
+        await db.execute("ALTER TABLE games ADD COLUMN guess_history BLOB NOT NULL DEFAULT x''")
+
+    guesses = await db.fetch_all(
+        """
+        SELECT game_id, valid_word_id
+        FROM guesses
+        ORDER BY game_id, guess_number
+        """
+    )
+    histories = {}
+    for game_id, valid_word_id in guesses:
+        histories.setdefault(game_id, []).append(valid_word_id)
+
+    async with db.transaction():
+        await db.execute_many(
+            "UPDATE games SET guess_history=:guess_history WHERE game_id=:game_id",
+            [
+                {"game_id": game_id, "guess_history": struct.pack(f">{len(word_ids)}H", *word_ids)}
+                for game_id, word_ids in histories.items()
+            ]
+        )
+
+    await db.disconnect()
+    print(f"{url}: packed the guesses of {len(histories)} games")
+
+
+# Run when executed as script.
+if __name__ == "__main__":
+    config = toml.load("./etc/wordle.toml")
+    for shard in config["SHARDS"]:
+        asyncio.run(migrate_shard(shard["PRIMARY_GAME_URL"]))
+    print("Migration of guesses complete")
@@ -0,0 +1,126 @@
+# Imports
+import argparse
+import asyncio
+import databases
+import os
+import sys
+import toml
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from shard import ShardRing
+from schema import prepare_shard, write_transaction
+
+# Move every user whose games live on a shard other than the one the hash ring now assigns them to.
+# Run this after adding or removing a [[SHARDS]] entry in etc/wordle.toml. Game ids keep working while it runs
+# because the game service falls back to the shard encoded in the id, and a user's games are moved while holding
+# the source shard's write lock so no guess made meanwhile is lost. Re-running after a crash is safe.
+
+
+# Establish database connection.
+async def _get_db(url):
+    db = databases.Database(url)
+    await db.connect()
+    return db
+
+
+def _insert_sql(table, columns, verb="INSERT"):
+    return "{} INTO {}({}) VALUES({})".format(
+        verb, table, ", ".join(columns), ", ".join(":" + column for column in columns)
+    )
+
+
+# Copy a user's games and guesses to the target shard, then delete them from the source shard
+async def move_user(source_db, target_db, username, games_table="games", guesses_table="guesses"):
+    # the source stays write locked until the copy is committed on the target and deleted from the source. The game
+    # service keeps writing the user's games to the source until they are on the target, so a guess made after the
+    # snapshot would otherwise be deleted with it
+    async with write_transaction(source_db):
+        games = await source_db.fetch_all(
+            f"SELECT * FROM {games_table} WHERE username=:username", values={"username": username}
+        )
+        guesses = await source_db.fetch_all(
+            f"""
+            SELECT {guesses_table}.*
+            FROM {guesses_table}
+            JOIN {games_table} USING(game_id)
+            WHERE {games_table}.username=:username
+            """,
+            values={"username": username}
+        )
+        game_rows = [dict(game._mapping) for game in games]
+        # guess ids are only unique within a shard, let the target assign new ones
+        guess_rows = [{k: v for k, v in guess._mapping.items() if k != "guess_id"} for guess in guesses]
+        user_games = f"SELECT game_id FROM {games_table} WHERE username=:username"
+        # only the games copied from the source, the user may already have new games on the target
+        copied_ids = {f"game_id{i}": game["game_id"] for i, game in enumerate(game_rows)}
+        copied_games = ", ".join(":" + name for name in copied_ids)
+        # old ids of migrated games resolve on the shard the game lives on
+        aliases = []
+        if game_rows:
+            aliases = await source_db.fetch_all(
+                f"SELECT old_game_id, game_id FROM game_id_aliases WHERE game_id IN ({copied_games})",
+                values=copied_ids
+            )
+        alias_rows = [dict(alias._mapping) for alias in aliases]
+
+        async with target_db.transaction():
+            if game_rows:
+                await target_db.execute(
+                    f"DELETE FROM {guesses_table} WHERE game_id IN ({copied_games})", values=copied_ids
+                )
+                await target_db.execute_many(
+                    _insert_sql(games_table, list(game_rows[0]), "INSERT OR REPLACE"), game_rows
+                )
+            if guess_rows:
+                await target_db.execute_many(_insert_sql(guesses_table, list(guess_rows[0])), guess_rows)
+            if alias_rows:
+                await target_db.execute_many(_insert_sql("game_id_aliases", list(alias_rows[0]), "INSERT OR REPLACE"),
+                                             alias_rows)
+
+        await source_db.execute(
+            f"DELETE FROM {guesses_table} WHERE game_id IN ({user_games})", values={"username": username}
+        )
+        if alias_rows:
+            await source_db.execute(
+                f"DELETE FROM game_id_aliases WHERE game_id IN ({copied_games})", values=copied_ids
+            )
+        await source_db.execute(
+            f"DELETE FROM {games_table} WHERE username=:username", values={"username": username}
+        )
+
+    return len(game_rows)
+
+
+async def rebalance(config, dry_run):
+    shards = ShardRing(config["SHARDS"])
+    dbs = {name: await _get_db(shards.primary_url(name)) for name in shards.shards}
+    for db in dbs.values():
+        await prepare_shard(db)
+
+    moved_users = 0
+    for name, db in dbs.items():
+        users = await db.fetch_all("SELECT username FROM games UNION SELECT username FROM games_archive")
+        for (username,) in users:
+            target = shards.shard_for(username)
+            if target == name:
+                continue
+            if dry_run:
+                print(f"Would move {username} from {name} to {target}")
+            else:
+                count = await move_user(db, dbs[target], username)
+                count += await move_user(db, dbs[target], username, "games_archive", "guesses_archive")
+                print(f"Moved {username} ({count} games) from {name} to {target}")
+            moved_users += 1
+
+    for db in dbs.values():
+        await db.disconnect()
+    print(f"Rebalancing complete, {moved_users} users {'to move' if dry_run else 'moved'}")
+
+
+# Run when executed as script.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move users to the game shard the hash ring assigns them to")
+    parser.add_argument("--dry-run", action="store_true", help="only print the users that would be moved")
+    args = parser.parse_args()
+
+    asyncio.run(rebalance(toml.load("./etc/wordle.toml"), args.dry_run))
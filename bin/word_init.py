@@ -24,8 +24,8 @@ def load_json_from_file(file_name):
 
 
 # Establish database connection.
-async def _get_db():
-    db = databases.Database(app.config["DATABASES"]["PRIMARY_GAME_URL"])
+async def _get_db(url):
+    db = databases.Database(url)
     await db.connect()
     return db
 
@@ -37,9 +37,11 @@ async def load_data(file_name, table_name):
     for item in data:
         words.append({"word": item})
 
-    print("Loading data into " + table_name + " table, please wait...")
-    db = await _get_db()
-    await db.execute_many("INSERT into " + table_name + "(" + table_name[:-1] + ") values(:word)", words)
+    # every shard keeps its own copy of the words so games never need a cross-shard join
+    for shard in app.config["SHARDS"]:
+        print("Loading data into " + table_name + " table of shard " + shard["NAME"] + ", please wait...")
+        db = await _get_db(shard["PRIMARY_GAME_URL"])
+        await db.execute_many("INSERT into " + table_name + "(" + table_name[:-1] + ") values(:word)", words)
 
 # Run when executed as script.
 if __name__ == "__main__":
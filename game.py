@@ -2,16 +2,19 @@
 import dataclasses
 import itertools
 import random
+import sqlite3
+import struct
 import textwrap
-import uuid
 import databases
 import toml
 from quart import Quart, g, request, abort, jsonify
 from quart_schema import QuartSchema, RequestSchemaValidationError, validate_request, tag
-from redis import Redis
-import rq
-import httpx
 import time
+from shard import ShardRing, encode_game_id, decode_game_id
+from group_commit import GroupCommitWriter, execute_writes
+from schema import prepare_shard
+from game_key import ID_FORMATS, new_game_key, game_key_to_str, game_key_from_str
+from webhooks import enqueue_deliveries, delivery_metrics
 
 # Initialize the app
 app = Quart(__name__)
@@ -28,32 +31,148 @@ class Word:
     guess: str
 
 
-db_list = ['PRIMARY_GAME_URL', 'SECONDARY_GAME_URL', 'TERTIARY_GAME_URL']
-iterator = itertools.cycle(db_list)
+@dataclasses.dataclass
+class GameBatch:
+    count: int
 
 
-# Establish database connection
-async def _get_read_db(db):
-    db = g._sqlite_read_db = databases.Database(app.config["DATABASES"][db])
-    await db.connect()
-    return db
+# Most games one POST /games/batch may create
+MAX_GAME_BATCH = 100
+
+
+shards = ShardRing(app.config["SHARDS"])
+# Reads for a shard are spread round-robin over its primary and replicas
+read_iterators = {name: itertools.cycle(shards.read_urls(name)) for name in shards.shards}
+# The callback urls are kept on the first shard
+CALLBACK_SHARD = app.config["SHARDS"][0]["NAME"]
+
+GAME_ID_FORMAT = app.config.get("GAMES", {}).get("ID_FORMAT", "uuid")
+if GAME_ID_FORMAT not in ID_FORMATS:
+    raise ValueError(f"ID_FORMAT must be one of {ID_FORMATS}, not {GAME_ID_FORMAT!r}")
+
+# 'table' keeps one guesses row per guess, 'packed' keeps the ordered valid_word_ids in games.guess_history
+GUESS_STORAGE = app.config.get("GAMES", {}).get("GUESS_STORAGE", "table")
+if GUESS_STORAGE not in ("table", "packed"):
+    raise ValueError(f"GUESS_STORAGE must be 'table' or 'packed', not {GUESS_STORAGE!r}")
+
+# Seconds a finished game's response may be cached for
+FINISHED_GAME_MAX_AGE = 365 * 24 * 3600
 
+# valid_word_id -> valid_word and back, loaded once per process for the packed guess history
+valid_words = {}
+valid_word_ids = {}
 
-async def _get_write_db():
-    db = g._sqlite_write_db = databases.Database(app.config["DATABASES"]['PRIMARY_GAME_URL'])
-    await db.connect()
+
+# Establish database connection, one per database url for the request
+async def _get_db(url):
+    dbs = getattr(g, "_sqlite_dbs", None)
+    if dbs is None:
+        dbs = g._sqlite_dbs = {}
+    db = dbs.get(url)
+    if db is None:
+        db = dbs[url] = databases.Database(url)
+        await db.connect()
     return db
 
 
+async def _get_read_db(shard):
+    return await _get_db(next(read_iterators[shard]))
+
+
+async def _get_write_db(shard):
+    return await _get_db(shards.primary_url(shard))
+
+
+# Find the shard holding a game. The user's shard is authoritative, the shard encoded in the game id is only
+# checked when the game is not there yet, i.e. while bin/rebalance_shards.py is moving the user.
+async def _get_game_shard(username, game_id):
+    shard = shards.shard_for(username)
+    home_shard, game_key = decode_game_id(game_id)
+    game_key = game_key_from_str(game_key)
+    if home_shard in (None, shard) or home_shard not in shards.shards:
+        return shard
+
+    write_db = await _get_write_db(shard)
+    game_key = await _resolve_game_key(write_db, game_key)
+    found = await write_db.fetch_one(
+        """
+        SELECT 1 FROM games WHERE game_id=:game_id
+        UNION ALL
+        SELECT 1 FROM games_archive WHERE game_id=:game_id
+        """,
+        values={"game_id": game_key}
+    )
+    return shard if found else home_shard
+
+
+# Games created before bin/migrate_game_ids.py keep their old text key as an alias of their ULID
+async def _resolve_game_key(db, game_key):
+    if GAME_ID_FORMAT != "ulid" or not isinstance(game_key, str):
+        return game_key
+    try:
+        ulid_key = await db.fetch_val(
+            "SELECT game_id FROM game_id_aliases WHERE old_game_id=:game_id", values={"game_id": game_key}
+        )
+    except sqlite3.OperationalError as e:
+        # a replica may not have the table created at startup yet, then nothing has been migrated either
+        if "no such table" not in str(e):
+            raise
+        return game_key
+    return game_key if ulid_key is None else ulid_key
+
+
+# Group commit writers, one per shard primary, only when enabled in etc/wordle.toml
+writers = {}
+
+
+# Databases created by older versions of share/games.sql are missing the archive and alias tables and new columns
+@app.before_serving
+async def prepare_shards():
+    for name in shards.shards:
+        db = databases.Database(shards.primary_url(name))
+        await db.connect()
+        try:
+            await prepare_shard(db)
+        finally:
+            await db.disconnect()
+
+
+@app.before_serving
+async def start_group_commit():
+    group_commit = app.config.get("GROUP_COMMIT", {})
+    if not group_commit.get("ENABLED"):
+        return
+    for name in shards.shards:
+        writer = writers[name] = GroupCommitWriter(
+            shards.primary_url(name), group_commit["WINDOW_MS"], group_commit["MAX_BATCH"]
+        )
+        await writer.start()
+
+
+@app.after_serving
+async def stop_group_commit():
+    for writer in writers.values():
+        await writer.stop()
+    writers.clear()
+
+
+# Apply a request's write set atomically on a shard's primary, batched with other requests when group commit is on
+async def _write(shard, writes):
+    writer = writers.get(shard)
+    if writer is not None:
+        return await writer.submit(writes)
+    write_db = await _get_write_db(shard)
+    async with write_db.transaction():
+        return await execute_writes(write_db, writes)
+
+
 # Terminate database connection
 @app.teardown_appcontext
 async def close_connection(exception):
-    write_db = getattr(g, "_sqlite_write_db", None)
-    if write_db is not None:
-        await write_db.disconnect()
-    read_db = getattr(g, "_sqlite_read_db", None)
-    if read_db is not None:
-        await read_db.disconnect()
+    dbs = getattr(g, "_sqlite_dbs", None)
+    if dbs is not None:
+        for db in dbs.values():
+            await db.disconnect()
 
 
 @tag(["Root"])
@@ -72,10 +191,9 @@ async def index():
 @app.route("/games", methods=["POST"])
 async def create_game():
     """ Create a game """
-    iter_val = next(iterator)
-    read_db = await _get_read_db(iter_val)
-    write_db = await _get_write_db()
     username = request.authorization.username
+    shard = shards.shard_for(username)
+    read_db = await _get_read_db(shard)
 
     # Open a file and load json from it
     res = await read_db.fetch_one(
@@ -84,17 +202,52 @@ async def create_game():
         """
     )
     length = res.count
-    uuid1 = str(uuid.uuid4())
+    game_key = new_game_key(GAME_ID_FORMAT)
 
-    await write_db.execute(
+    await _write(shard, [(
         """
         INSERT INTO games(game_id, username, secret_word_id)
-        VALUES(:uuid, :user, :secret_word_id)
+        VALUES(:game_id, :user, :secret_word_id)
         """,
-        values={"uuid": uuid1, "user": username, "secret_word_id": random.randint(1, length)}
+        {"game_id": game_key, "user": username, "secret_word_id": random.randint(1, length)}
+    )])
+
+    return {"game_id": encode_game_id(shard, game_key_to_str(game_key)), "message": "Game Successfully Created"}, 200
+
+
+@tag(["Games"])
+@app.route("/games/batch", methods=["POST"])
+@validate_request(GameBatch)
+async def create_games(data):
+    """ Create up to 100 games at once, pass the number of games as count """
+    if data.count < 1 or data.count > MAX_GAME_BATCH:
+        abort(400, f"Please pass a count between 1 and {MAX_GAME_BATCH}")
+    username = request.authorization.username
+    shard = shards.shard_for(username)
+    read_db = await _get_read_db(shard)
+
+    res = await read_db.fetch_one(
+        """
+        SELECT count(*) count FROM correct_words
+        """
     )
+    length = res.count
+    games = [
+        {"game_id": new_game_key(GAME_ID_FORMAT), "user": username, "secret_word_id": random.randint(1, length)}
+        for _ in range(data.count)
+    ]
+
+    # one transaction for the whole batch
+    await _write(shard, [(
+        """
+        INSERT INTO games(game_id, username, secret_word_id)
+        VALUES(:game_id, :user, :secret_word_id)
+        """,
+        games
+    )])
 
-    return {"game_id": uuid1, "message": "Game Successfully Created"}, 200
+    game_ids = [encode_game_id(shard, game_key_to_str(game["game_id"])) for game in games]
+    return {"game_ids": game_ids, "message": f"{len(game_ids)} Games Successfully Created"}, 200
 
 
 @validate_request(Word)
@@ -103,48 +256,92 @@ async def create_game():
 async def play_game(game_id):
     """ Play the game (creating a guess) """
     data = await request.json
-    read_db = await _get_read_db(next(iterator))
-    write_db = await _get_write_db()
-
     username = request.authorization.username
+    shard = await _get_game_shard(username, game_id)
+    read_db = await _get_read_db(shard)
 
-    return await play_game_or_check_progress(read_db, write_db, username, game_id, data["guess"])
+    return await play_game_or_check_progress(read_db, shard, username, game_id, data["guess"])
 
 
 @tag(["Games"])
 @app.route("/games/<string:game_id>", methods=["GET"])
 async def check_game_progress(game_id):
     """ Check the state of a game that is in progress. If game is over show whether user won/lost and no. of guesses """
-    read_db = await _get_read_db(next(iterator))
-    write_db = await _get_write_db()
+    # a finished game never changes, so a client holding its ETag already has the current response
+    for etag in request.if_none_match:
+        if _is_finished_game_etag(game_id, etag):
+            return "", 304, _game_cache_headers(etag, finished=True)
+
     username = request.authorization.username
+    shard = await _get_game_shard(username, game_id)
+    read_db = await _get_read_db(shard)
+
+    game_output, status = await play_game_or_check_progress(read_db, shard, username, game_id)
+    if "decision" in game_output:
+        etag = _game_etag(game_id, game_output["decision"], game_output["number_of_guesses"])
+        headers = _game_cache_headers(etag, finished=True)
+    else:
+        etag = _game_etag(game_id, "progress", 6 - game_output["guess_remaining"])
+        headers = _game_cache_headers(etag, finished=False)
+
+    if request.if_none_match.contains(etag):
+        return "", 304, headers
+    return game_output, status, headers
+
+
+# ETags of a game name its state and number of guesses, e.g. "s0.01HF...:win:3" or "s0.01HF...:progress:2"
+def _game_etag(game_id, decision, number_of_guesses):
+    return f"{game_id}:{decision}:{number_of_guesses}"
 
-    return await play_game_or_check_progress(read_db, write_db, username, game_id)
+
+def _is_finished_game_etag(game_id, etag):
+    etag_game_id, _, rest = etag.partition(":")
+    return etag_game_id == game_id and rest.split(":")[0] in ("win", "loss")
+
+
+# Finished games are cached for good, by the browser and by nginx (X-Accel-Expires, see share/wordle).
+# Games in progress must be revalidated on every request.
+def _game_cache_headers(etag, finished):
+    headers = {"ETag": f'"{etag}"', "Vary": "Authorization"}
+    if finished:
+        headers["Cache-Control"] = f"private, max-age={FINISHED_GAME_MAX_AGE}, immutable"
+        headers["X-Accel-Expires"] = str(FINISHED_GAME_MAX_AGE)
+    else:
+        headers["Cache-Control"] = "private, no-cache"
+    return headers
 
 
 @tag(["Statistics"])
 @app.route("/games", methods=["GET"])
 async def get_in_progress_games():
     """ Check the list of in-progress games for a particular user """
-    read_db = await _get_read_db(next(iterator))
     username = request.authorization.username
 
-    # showing only in-progress games
-    games_output = await read_db.fetch_all(
-        """
-        SELECT guess_remaining, game_id, state
-        FROM games
-        WHERE username =:username AND state = :state
-        """,
-        values={"username": username, "state": 0}
-    )
-
     in_progress_games = []
-    for guess_remaining, game_id, state in games_output:
-        in_progress_games.append({
-            "guess_remaining": guess_remaining,
-            "game_id": game_id
-        })
+    seen_games = set()
+    # while the user is being rebalanced some games may still be on the previous shard
+    for shard in shards.shards_for(username):
+        read_db = await _get_read_db(shard)
+
+        # showing only in-progress games
+        games_output = await read_db.fetch_all(
+            """
+            SELECT guess_remaining, game_id, state
+            FROM games
+            WHERE username =:username AND state = :state
+            """,
+            values={"username": username, "state": 0}
+        )
+
+        for guess_remaining, game_id, state in games_output:
+            # a game being moved can briefly be on both shards
+            if game_id in seen_games:
+                continue
+            seen_games.add(game_id)
+            in_progress_games.append({
+                "guess_remaining": guess_remaining,
+                "game_id": encode_game_id(shard, game_key_to_str(game_id))
+            })
 
     return in_progress_games
 
@@ -153,22 +350,46 @@ async def get_in_progress_games():
 @app.route("/games/statistics", methods=["GET"])
 async def statistics():
     """ Checking the statistics for a particular user """
-    db = await _get_read_db(next(iterator))
     username = request.authorization.username
-
-    res_games = await db.fetch_all(
-        """
-        SELECT state, count(*)
-        FROM games
-        WHERE username=:username
-        GROUP BY state
-        """,
-        values={"username": username}
-    )
     states = {0: 'In Progress', 1: 'win', 2: "loss"}
+    user_shards = shards.shards_for(username)
+
+    if len(user_shards) == 1:
+        db = await _get_read_db(user_shards[0])
+        res_games = await db.fetch_all(
+            """
+            SELECT state, count(*)
+            FROM (
+                SELECT state FROM games WHERE username=:username
+                UNION ALL
+                SELECT state FROM games_archive WHERE username=:username
+            )
+            GROUP BY state
+            """,
+            values={"username": username}
+        )
+        return {states[state]: count for state, count in res_games}
+
+    # while the user is being rebalanced some games may still be on the previous shard, and a game being moved
+    # can briefly be on both, so count each game once
+    game_states = {}
+    for shard in user_shards:
+        db = await _get_read_db(shard)
+        res_games = await db.fetch_all(
+            """
+            SELECT game_id, state FROM games WHERE username=:username
+            UNION ALL
+            SELECT game_id, state FROM games_archive WHERE username=:username
+            """,
+            values={"username": username}
+        )
+        for game_id, state in res_games:
+            # the user's current shard comes first and has the latest state
+            game_states.setdefault(game_id, state)
+
     games_stats = {}
-    for state, count in res_games:
-        games_stats[states[state]] = count
+    for state in game_states.values():
+        games_stats[states[state]] = games_stats.get(states[state], 0) + 1
 
     return games_stats
 
@@ -181,24 +402,44 @@ async def client_register():
     # Get the call back url from client
     callback_url = data.get("url")
     # Get readable database
-    read_db = await _get_read_db(next(iterator))
+    read_db = await _get_read_db(CALLBACK_SHARD)
     # Get writable database
-    write_db = await _get_write_db()
+    write_db = await _get_write_db(CALLBACK_SHARD)
     # Store the url in database
     return await save_callbakc_urls(read_db, write_db, callback_url)
 
 
-async def play_game_or_check_progress(read_db, write_db, username, game_id, guess=None):
+@tag(["ClientRegister"])
+@app.route("/webhooks/metrics", methods=["GET"])
+async def webhook_metrics():
+    """ Delivery counters, queue depth, scheduled retries, dead letters and open circuits of the callback urls """
+    return delivery_metrics(), 200
+
+
+async def play_game_or_check_progress(read_db, shard, username, game_id, guess=None):
     states = {0: 'In Progress', 1: 'win', 2: "loss"}
+    _, game_key = decode_game_id(game_id)
+    game_key = await _resolve_game_key(read_db, game_key_from_str(game_key))
     games_output = await read_db.fetch_one(
         """
-        SELECT correct_words.correct_word secret_word, guess_remaining, state
+        SELECT correct_words.correct_word secret_word, games.*
         FROM games join correct_words WHERE username=:username
         AND game_id=:game_id AND correct_words.correct_word_id=games.secret_word_id
         """,
-        values={"game_id": game_id, "username": username}
+        values={"game_id": game_key, "username": username}
     )
 
+    if not games_output:
+        # finished games are moved to the archive after a while
+        games_output = await read_db.fetch_one(
+            """
+            SELECT guess_remaining, state
+            FROM games_archive
+            WHERE username=:username AND game_id=:game_id
+            """,
+            values={"game_id": game_key, "username": username}
+        )
+
     if not games_output:
         abort(400, "No game with this identifier for your username")
 
@@ -211,7 +452,7 @@ async def play_game_or_check_progress(read_db, write_db, username, game_id, gues
     guess_remaining = games_output["guess_remaining"]
 
     if guess is None:
-        guess_output = await fetch_guesses(read_db, game_id)
+        guess_output = await fetch_guesses(read_db, game_key, games_output)
     else:
         if len(guess) != 5:
             abort(400, "Bad Request: Word length should be 5")
@@ -219,14 +460,18 @@ async def play_game_or_check_progress(read_db, write_db, username, game_id, gues
         if guess == secret_word:
             state = 1
 
-        valid_word_output = await read_db.fetch_one(
-            """
-            SELECT valid_word_id
-            FROM valid_words
-            WHERE valid_word =:word
-            """,
-            values={"word": guess}
-        )
+        if GUESS_STORAGE == "packed":
+            await _load_valid_words(read_db)
+            valid_word_output = valid_word_ids.get(guess)
+        else:
+            valid_word_output = await read_db.fetch_one(
+                """
+                SELECT valid_word_id
+                FROM valid_words
+                WHERE valid_word =:word
+                """,
+                values={"word": guess}
+            )
         if not valid_word_output:
             if not state:
                 abort(400, "Bad Request: Not a valid guess")
@@ -239,44 +484,64 @@ async def play_game_or_check_progress(read_db, write_db, username, game_id, gues
             # user lost the game
             if guess_remaining == 0 and state == 0:
                 state = 2
-            await write_db.execute(
+            await _write(shard, [(
                 """
                 UPDATE games
-                SET guess_remaining=:guess_remaining, state=:state
+                SET guess_remaining=:guess_remaining, state=:state, finished_at=:finished_at
                 WHERE game_id=:game_id
                 """,
-                values={"guess_remaining": guess_remaining, "game_id": game_id, "state": state}
-            )
+                {"guess_remaining": guess_remaining, "game_id": game_key, "state": state, "finished_at": int(time.time())}
+            )])
             game_data = {"status": states[state], "username": username, "guess_number": guess_number}
-            await enqueue_game_status(read_db, game_data)
+            await enqueue_game_status(await _get_read_db(CALLBACK_SHARD), game_data)
 
             return {"game_id": game_id, "number_of_guesses": 6 - guess_remaining, "decision": states[state]}, 200
 
         # else prepare the response and insert into guesses afterwards to ensure read-your-write consistency
 
-        valid_word_id = valid_word_output.valid_word_id
-
-        guess_output = await fetch_guesses(read_db, game_id)
+        guess_output = await fetch_guesses(read_db, game_key, games_output)
 
         new_guess = (guess_number, guess)
         guess_output.append(new_guess)
 
-        await write_db.execute(
-            """
-            UPDATE games
-            SET guess_remaining=:guess_remaining
-            WHERE game_id=:game_id
-            """,
-            values={"guess_remaining": guess_remaining, "game_id": game_id}
-        )
-
-        await write_db.execute(
-            """
-            INSERT INTO guesses(game_id, valid_word_id, guess_number)
-            VALUES(:game_id, :valid_word_id, :guess_number)
-            """,
-            values={"game_id": game_id, "valid_word_id": valid_word_id, "guess_number": guess_number}
-        )
+        if GUESS_STORAGE == "packed":
+            # the whole game is one row, a guess is a single update. The guess is appended in SQL and only if
+            # no other guess got in since the game was read, so a stale replica can't overwrite earlier guesses.
+            changed, = await _write(shard, [(
+                """
+                UPDATE games
+                SET guess_remaining=:guess_remaining, guess_history=CAST(guess_history || :guess AS BLOB)
+                WHERE game_id=:game_id AND guess_remaining=:previous_remaining
+                """,
+                {
+                    "guess_remaining": guess_remaining,
+                    "guess": pack_guesses([valid_word_output]),
+                    "game_id": game_key,
+                    "previous_remaining": games_output["guess_remaining"]
+                }
+            )])
+            if not changed:
+                abort(409, "The game changed while guessing, please check its progress and guess again")
+        else:
+            valid_word_id = valid_word_output.valid_word_id
+
+            await _write(shard, [
+                (
+                    """
+                    UPDATE games
+                    SET guess_remaining=:guess_remaining
+                    WHERE game_id=:game_id
+                    """,
+                    {"guess_remaining": guess_remaining, "game_id": game_key}
+                ),
+                (
+                    """
+                    INSERT INTO guesses(game_id, valid_word_id, guess_number)
+                    VALUES(:game_id, :valid_word_id, :guess_number)
+                    """,
+                    {"game_id": game_key, "valid_word_id": valid_word_id, "guess_number": guess_number}
+                ),
+            ])
 
     guesses = []
     for guess_number, valid_word in guess_output:
@@ -293,30 +558,36 @@ async def play_game_or_check_progress(read_db, write_db, username, game_id, gues
     return {"guesses": guesses, "guess_remaining": guess_remaining, "game_state": states[state]}, 200
 
 
-def send_scores_job(url, game_results):
+async def enqueue_game_status(read_db, game_results):
+    callback_url_output = await read_db.fetch_all("SELECT url from callback_urls")
+    # for each url enqueue a job to send the scores, retries are scheduled by the job itself
+    urls = [url for (url,) in callback_url_output]
+    app.logger.info(urls)
+    enqueue_deliveries(urls, game_results)
 
-    response = httpx.post(url, json=game_results)
-    return response
 
+# Packed guess history: the valid_word_ids of a game's guesses in order, as big-endian uint16s
+def pack_guesses(word_ids):
+    return struct.pack(f">{len(word_ids)}H", *word_ids)
 
-async def enqueue_game_status(read_db, game_results):
-    callback_url_output = await read_db.fetch_all("SELECT url from callback_urls")
-    # for each url enqueue a job to send the scores
-    if len(callback_url_output) < 0:
-        return
-    callback_url = callback_url_output[0]
-    app.logger.info(callback_url)
-    for url in callback_url:
 
-        queue = rq.Queue(connection=Redis())
-        job = queue.enqueue(send_scores_job, url, game_results)
+def unpack_guesses(guess_history):
+    return struct.unpack(f">{len(guess_history) // 2}H", guess_history)
+
 
-        if job is not None:
-            time.sleep(2)
-            app.logger.info(job.result)
+async def _load_valid_words(read_db):
+    if not valid_words:
+        for valid_word_id, valid_word in await read_db.fetch_all("SELECT valid_word_id, valid_word FROM valid_words"):
+            valid_words[valid_word_id] = valid_word
+            valid_word_ids[valid_word] = valid_word_id
 
 
-async def fetch_guesses(read_db, game_id):
+async def fetch_guesses(read_db, game_id, game):
+    if GUESS_STORAGE == "packed":
+        await _load_valid_words(read_db)
+        return [(number, valid_words[valid_word_id])
+                for number, valid_word_id in enumerate(unpack_guesses(game["guess_history"]), start=1)]
+
     # Prepare the response
     guess_output = await read_db.fetch_all(
         """
@@ -380,6 +651,12 @@ def bad_request(e):
     return {"error": str(e.validation_error)}, 400
 
 
+# Error status: Conflicting request.
+@app.errorhandler(409)
+def conflict(e):
+    return jsonify({'message': e.description}), 409
+
+
 # Error status: Cannot or will not process the request.
 @app.errorhandler(400)
 def bad_request(e):
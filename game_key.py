@@ -0,0 +1,72 @@
+# Imports
+import os
+import time
+import uuid
+
+# Game keys are what the games and guesses tables store as game_id.
+# 'uuid' keys are random uuid4 strings, 'ulid' keys are 16 byte ULIDs: a 48 bit millisecond timestamp followed by
+# 80 random bits. ULIDs sort by creation time, so new games are appended to the end of the primary key and
+# guess indexes instead of landing on a random page, and they take 16 bytes instead of 36.
+ID_FORMATS = ("uuid", "ulid")
+
+# Crockford's base32, used for the public form of a ULID
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ULID_LENGTH = 26
+
+_last_timestamp = 0
+_last_random = 0
+
+
+def new_ulid(timestamp_ms=None):
+    global _last_timestamp, _last_random
+    if timestamp_ms is None:
+        timestamp_ms = int(time.time() * 1000)
+    if timestamp_ms <= _last_timestamp:
+        # same millisecond: keep the ids of this process increasing
+        timestamp_ms = _last_timestamp
+        _last_random += 1
+        if _last_random >= 1 << 80:
+            # the random part ran out, borrow the next millisecond
+            timestamp_ms += 1
+            _last_random = 0
+    else:
+        _last_random = int.from_bytes(os.urandom(10), "big")
+    _last_timestamp = timestamp_ms
+    return ((timestamp_ms << 80) | _last_random).to_bytes(16, "big")
+
+
+def ulid_to_str(value):
+    number = int.from_bytes(value, "big")
+    chars = []
+    for _ in range(ULID_LENGTH):
+        chars.append(ALPHABET[number & 31])
+        number >>= 5
+    return "".join(reversed(chars))
+
+
+def ulid_from_str(value):
+    number = 0
+    for char in value.upper():
+        number = (number << 5) | ALPHABET.index(char)
+    return number.to_bytes(16, "big")
+
+
+def new_game_key(id_format):
+    if id_format == "ulid":
+        return new_ulid()
+    return str(uuid.uuid4())
+
+
+def game_key_to_str(key):
+    return ulid_to_str(key) if isinstance(key, bytes) else key
+
+
+# Turn the key part of a public game id back into what the database stores. Both formats can live in the same
+# database, a ULID is told apart by its length.
+def game_key_from_str(value):
+    if len(value) == ULID_LENGTH:
+        try:
+            return ulid_from_str(value)
+        except (ValueError, OverflowError):
+            pass
+    return value
@@ -0,0 +1,95 @@
+# Imports
+import asyncio
+import databases
+
+
+# Run a write set, a list of (query, values) pairs. A list of values runs the query once per entry.
+# Returns the number of rows each single query changed, None for the lists.
+async def execute_writes(db, writes):
+    results = []
+    for query, values in writes:
+        if isinstance(values, list):
+            await db.execute_many(query, values)
+            results.append(None)
+        else:
+            await db.execute(query, values)
+            results.append(await db.fetch_val("SELECT changes()"))
+    return results
+
+
+class GroupCommitWriter:
+    """ Single writer task for one database, committing the write sets of many requests in one transaction """
+
+    def __init__(self, url, window_ms, max_batch):
+        self.url = url
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = asyncio.Queue()
+        self._db = None
+        self._task = None
+
+    async def start(self):
+        self._db = databases.Database(self.url)
+        await self._db.connect()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        # fail whatever was submitted after the last batch
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Group commit writer stopped"))
+        await self._db.disconnect()
+
+    async def submit(self, writes):
+        """ Queue a write set and wait until the batch holding it is committed """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((writes, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # wait for the first write set, then collect more until the window closes or the batch is full
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._commit(batch)
+
+    async def _commit(self, batch):
+        outcomes = []
+        try:
+            async with self._db.transaction():
+                for writes, future in batch:
+                    # each write set gets a savepoint so one failing request doesn't roll back the others
+                    try:
+                        async with self._db.transaction():
+                            outcomes.append((future, await execute_writes(self._db, writes), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in outcomes:
+            # the request may have gone away while waiting for the commit
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -1,12 +1,15 @@
 # Imports
+import asyncio
 import dataclasses
+import json
 import os
 import socket
 import time
 
-from quart import Quart, jsonify, abort
+from quart import Quart, jsonify, abort, make_response
 from quart_schema import QuartSchema, tag, validate_request, RequestSchemaValidationError
 import redis
+import redis.asyncio
 import httpx
 
 # Initialize the app
@@ -52,6 +55,107 @@ def _initialize_redis():
     return r
 
 
+LEADERBOARD_SIZE = 10
+# add_game_results publishes the new top users here whenever they change
+LEADERBOARD_CHANNEL = "wordle_leaderboard_updates"
+# Changes published within this many seconds of each other reach the viewers as one event
+COALESCE_SECONDS = 0.25
+# Wait between attempts to get the subscription back after the Redis connection drops, doubling up to the max
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 30
+# Idle streams get a comment this often so proxies don't close them
+KEEPALIVE_SECONDS = 15
+
+
+def _top_users(r):
+    return r.zrevrange("wordle_leaderboard", 0, LEADERBOARD_SIZE - 1, True)
+
+
+def _format_leaderboard(avg_score_result):
+    leaderboard_result = []
+
+    for user, score in avg_score_result:
+        user = user.decode('UTF-8').split(':')[1]
+        leaderboard_result.append({"username": user,  "score": score})
+
+    return leaderboard_result
+
+
+class LeaderboardBroadcaster:
+    """ One Redis subscription to the leaderboard channel, shared by every connected stream """
+
+    def __init__(self):
+        self.viewers = set()
+        self._task = None
+        self._subscribed = False
+
+    def subscribe(self):
+        # a viewer only ever needs the latest leaderboard, so its queue holds one event
+        queue = asyncio.Queue(maxsize=1)
+        self.viewers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.viewers.discard(queue)
+        if not self.viewers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        delay = RECONNECT_MIN_SECONDS
+        resend = False
+        while True:
+            try:
+                await self._listen(resend)
+            except (redis.exceptions.RedisError, OSError) as e:
+                app.logger.error(f"Leaderboard subscription lost: {e}")
+            # back off only while reconnecting keeps failing
+            if self._subscribed:
+                delay = RECONNECT_MIN_SECONDS
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+            # changes published while disconnected were missed, send the current list after reconnecting
+            resend = True
+
+    async def _listen(self, resend):
+        self._subscribed = False
+        r = redis.asyncio.Redis()
+        pubsub = r.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(LEADERBOARD_CHANNEL)
+            self._subscribed = True
+            if resend:
+                top_users = await r.zrevrange("wordle_leaderboard", 0, LEADERBOARD_SIZE - 1, True)
+                self._publish(json.dumps(_format_leaderboard(top_users)))
+            async for message in pubsub.listen():
+                # wait for the rest of a burst and only send the last leaderboard of it
+                await asyncio.sleep(COALESCE_SECONDS)
+                data = message["data"]
+                while True:
+                    message = await pubsub.get_message(timeout=0)
+                    if message is None:
+                        break
+                    data = message["data"]
+                self._publish(data.decode("UTF-8"))
+        finally:
+            try:
+                await pubsub.unsubscribe(LEADERBOARD_CHANNEL)
+                await r.close()
+            except (redis.exceptions.RedisError, OSError):
+                pass
+
+    def _publish(self, data):
+        for queue in self.viewers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(data)
+
+
+broadcaster = LeaderboardBroadcaster()
+
+
 @tag(["Leaderboard"])
 @app.route("/results", methods=["POST"])
 @validate_request(Result)
@@ -91,7 +195,11 @@ async def add_game_results(data):
 
     avg_score = total_score / number_of_games
 
+    top_users = _top_users(r)
     r.zadd("wordle_leaderboard", {"users:" + username: avg_score})
+    new_top_users = _top_users(r)
+    if new_top_users != top_users:
+        r.publish(LEADERBOARD_CHANNEL, json.dumps(_format_leaderboard(new_top_users)))
     return {"Message": "Game results successfully posted."}, 201
 
 
@@ -101,20 +209,44 @@ async def leaderboard():
     """ Retrieve the list of top 10 users of the wordle game based on their average scores """
     r = _initialize_redis()
 
-    avg_score_result = r.zrevrange("wordle_leaderboard", 0, 9, True)
+    avg_score_result = _top_users(r)
     # prepare response
 
     # no users in the redis
     if len(avg_score_result) == 0:
         return "Please post results to retrieve the top 10 users by average score", 200
 
-    leaderboard_result = []
+    return _format_leaderboard(avg_score_result), 200
 
-    for user, score in avg_score_result:
-        user = user.decode('UTF-8').split(':')[1]
-        leaderboard_result.append({"username": user,  "score": score})
 
-    return leaderboard_result, 200
+@tag(["Leaderboard"])
+@app.route("/leaderboard/stream", methods=["GET"])
+async def leaderboard_stream():
+    """ Stream the top 10 users as Server-Sent Events, the current list first and then every change to it """
+    r = _initialize_redis()
+    current = json.dumps(_format_leaderboard(_top_users(r)))
+    queue = broadcaster.subscribe()
+
+    async def events():
+        try:
+            yield f"event: leaderboard\ndata: {current}\n\n".encode("UTF-8")
+            while True:
+                try:
+                    data = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield f"event: leaderboard\ndata: {data}\n\n".encode("UTF-8")
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    response = await make_response(events(), 200, {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    response.timeout = None
+    return response
 
 
 # Error status: Cannot or will not process the request.
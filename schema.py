@@ -0,0 +1,45 @@
+# Imports
+import contextlib
+import time
+
+# Upgrades of game databases created by older versions of share/games.sql. The game service runs prepare_shard
+# on every shard primary when it starts, so the columns and tables it uses exist before the first request.
+
+
+# A transaction that takes the write lock right away. A plain BEGIN only takes it at the first write, so a
+# transaction that reads first fails with 'database is locked' when another connection wrote in between.
+@contextlib.asynccontextmanager
+async def write_transaction(db):
+    # keep one connection for the whole transaction
+    async with db.connection():
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            await db.execute("ROLLBACK")
+            raise
+        await db.execute("COMMIT")
+
+
+# Create the archive tables, alias table and columns missing from databases made before they existed
+async def prepare_shard(db):
+    async with write_transaction(db):
+        with open("./share/games_archive.sql") as f:
+            for statement in f.read().split(";"):
+                if statement.strip():
+                    await db.execute(statement)
+        await db.execute(
+            "CREATE TABLE IF NOT EXISTS game_id_aliases(old_game_id VARCHAR PRIMARY KEY, game_id VARCHAR NOT NULL)"
+        )
+
+        columns = [column["name"] for column in await db.fetch_all("PRAGMA table_info(games)")]
+        if "guess_history" not in columns:
+            await db.execute("ALTER TABLE games ADD COLUMN guess_history BLOB NOT NULL DEFAULT x''")
+        if "finished_at" not in columns:
+            await db.execute("ALTER TABLE games ADD COLUMN finished_at INTEGER NULL")
+            await db.execute("CREATE INDEX IF NOT EXISTS games_idx_finishedat ON games(finished_at)")
+        # games finished before finished_at was recorded start aging now
+        await db.execute(
+            "UPDATE games SET finished_at=:now WHERE state != 0 AND finished_at IS NULL",
+            values={"now": int(time.time())}
+        )
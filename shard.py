@@ -0,0 +1,84 @@
+# Imports
+import bisect
+import hashlib
+import os
+
+import toml
+
+# Number of points each shard owns on the hash ring, more points spread users more evenly
+VIRTUAL_NODES = 128
+
+# Separator between the shard name and the key in a public game id, e.g. "s0.8f2c..."
+GAME_ID_SEPARATOR = "."
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class ShardRing:
+    """ Consistent hash ring mapping usernames onto the shard groups configured in etc/wordle.toml """
+
+    def __init__(self, shards, virtual_nodes=VIRTUAL_NODES):
+        # shards marked NEW are still being filled by bin/rebalance_shards.py, the ring without them tells
+        # where a user's games were before
+        old_shards = [shard for shard in shards if not shard.get("NEW")]
+        self._previous = None
+        if old_shards and len(old_shards) < len(shards):
+            self._previous = ShardRing(old_shards, virtual_nodes)
+
+        self.shards = {}
+        for shard in shards:
+            if GAME_ID_SEPARATOR in shard["NAME"]:
+                raise ValueError(f"Shard name {shard['NAME']!r} may not contain {GAME_ID_SEPARATOR!r}")
+            self.shards[shard["NAME"]] = shard
+
+        points = sorted(
+            (_hash(f"{name}#{i}"), name) for name in self.shards for i in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def shard_for(self, username):
+        # walk clockwise to the first shard point at or after the username's hash
+        index = bisect.bisect(self._points, _hash(username)) % len(self._points)
+        return self._names[index]
+
+    # The user's shard, followed by the shard that owned the user before NEW shards were added
+    def shards_for(self, username):
+        shard = self.shard_for(username)
+        if self._previous is None:
+            return [shard]
+        previous_shard = self._previous.shard_for(username)
+        return [shard] if previous_shard == shard else [shard, previous_shard]
+
+    def primary_url(self, name):
+        return self.shards[name]["PRIMARY_GAME_URL"]
+
+    def read_urls(self, name):
+        shard = self.shards[name]
+        return [shard["PRIMARY_GAME_URL"], *shard.get("REPLICA_GAME_URLS", [])]
+
+
+# Public game ids carry the shard the game was created on, so a lookup can still find it while its user is
+# being moved by bin/rebalance_shards.py. The database only stores the key part.
+def encode_game_id(shard, game_key):
+    return f"{shard}{GAME_ID_SEPARATOR}{game_key}"
+
+
+def decode_game_id(game_id):
+    shard, _, game_key = game_id.rpartition(GAME_ID_SEPARATOR)
+    # ids created before sharding have no shard part
+    return shard or None, game_key
+
+
+# Turn 'sqlite+aiosqlite:///var/primary/mount/games.db' into './var/primary/mount/games.db'
+def sqlite_path(url):
+    return os.path.join(".", url.split(":///", 1)[1])
+
+
+# Run when executed as script: print the primary database file of every shard, used by bin/init.sh
+if __name__ == "__main__":
+    config = toml.load("./etc/wordle.toml")
+    for shard in config["SHARDS"]:
+        print(sqlite_path(shard["PRIMARY_GAME_URL"]))
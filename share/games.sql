@@ -1,5 +1,8 @@
 PRAGMA foreign_keys=ON;
 BEGIN TRANSACTION;
+DROP TABLE IF EXISTS game_id_aliases;
+DROP TABLE IF EXISTS guesses_archive;
+DROP TABLE IF EXISTS games_archive;
 DROP TABLE IF EXISTS guesses;
 DROP TABLE IF EXISTS games;
 DROP TABLE IF EXISTS results;
@@ -11,6 +14,10 @@ CREATE TABLE games (
     secret_word_id INTEGER NOT NULL,
     state INTEGER DEFAULT 0,
     guess_remaining INTEGER DEFAULT 6,
+    -- valid_word_ids of the guesses as big-endian uint16s, used when GUESS_STORAGE is 'packed'
+    guess_history BLOB NOT NULL DEFAULT x'',
+    -- unix time the game was won or lost, finished games are moved to games_archive some time after it
+    finished_at INTEGER NULL,
     FOREIGN KEY(secret_word_id) REFERENCES correct_words(correct_word_id)
 );
 
@@ -23,9 +30,16 @@ CREATE TABLE guesses(
     FOREIGN KEY(valid_word_id) REFERENCES valid_words(valid_word_id)
 );
 
+-- text game keys from before bin/migrate_game_ids.py, so ids already handed out keep working
+CREATE TABLE game_id_aliases(
+    old_game_id VARCHAR PRIMARY KEY,
+    game_id VARCHAR NOT NULL
+);
+
 CREATE INDEX games_idx_usernamestate ON games(username, state);
 CREATE INDEX valid_words_idx_validword ON valid_words(valid_word);
 CREATE INDEX guesses_idx_idnumber ON guesses(game_id, guess_number);
+CREATE INDEX games_idx_finishedat ON games(finished_at);
 
 COMMIT;
 
@@ -0,0 +1,21 @@
+-- Finished games and their guesses, moved out of games and guesses by bin/archive_games.py
+-- Columns are the same as the games and guesses tables
+CREATE TABLE IF NOT EXISTS games_archive (
+    game_id VARCHAR PRIMARY KEY,
+    username VARCHAR NOT NULL,
+    secret_word_id INTEGER NOT NULL,
+    state INTEGER DEFAULT 0,
+    guess_remaining INTEGER DEFAULT 6,
+    guess_history BLOB NOT NULL DEFAULT x'',
+    finished_at INTEGER NULL
+);
+
+CREATE TABLE IF NOT EXISTS guesses_archive(
+    guess_id INTEGER PRIMARY KEY,
+    game_id VARCHAR NOT NULL,
+    valid_word_id INTEGER NULL,
+    guess_number INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS games_archive_idx_usernamestate ON games_archive(username, state);
+CREATE INDEX IF NOT EXISTS guesses_archive_idx_idnumber ON guesses_archive(game_id, guess_number);
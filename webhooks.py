@@ -0,0 +1,131 @@
+# Imports
+import datetime
+import json
+import random
+import time
+
+import httpx
+import rq
+from redis import Redis
+
+# Deliveries of game results to the registered callback urls, run by the rq worker.
+# A failed delivery is retried with exponential backoff and jitter by the scheduler built into the worker
+# (rq worker --with-scheduler), up to MAX_ATTEMPTS or MAX_AGE_SECONDS after it was first enqueued, then moved to
+# the dead letter list. A 4xx other than 408 and 429 won't get better by retrying and is dead lettered at once.
+# Each subscriber has a circuit breaker: after CIRCUIT_FAILURE_THRESHOLD failures in a row its deliveries are
+# parked until the circuit closes again, so a subscriber that is down doesn't keep the worker busy with timeouts.
+
+MAX_ATTEMPTS = 8
+MAX_AGE_SECONDS = 24 * 3600
+BASE_DELAY_SECONDS = 2
+MAX_DELAY_SECONDS = 300
+DELIVERY_TIMEOUT_SECONDS = 5
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_OPEN_SECONDS = 60
+
+DEAD_LETTER_KEY = "webhooks:dead_letter"
+METRICS_KEY = "webhooks:metrics"
+CIRCUIT_KEY = "webhooks:circuit:"
+
+
+def enqueue_deliveries(urls, game_results):
+    queue = rq.Queue(connection=Redis())
+    for url in urls:
+        queue.enqueue(send_scores_job, url, game_results, 1, time.time())
+
+
+def send_scores_job(url, game_results, attempt=1, enqueued_at=None):
+    r = Redis()
+    queue = rq.Queue(connection=r)
+    if enqueued_at is None:
+        enqueued_at = time.time()
+
+    open_until = _circuit_open_until(r, url)
+    if open_until:
+        if time.time() - enqueued_at > MAX_AGE_SECONDS:
+            return _dead_letter(r, url, game_results, attempt, "circuit open")
+        # don't spend an attempt on a subscriber known to be down, spread the parked deliveries out a little
+        retry_at = open_until + random.uniform(0, CIRCUIT_OPEN_SECONDS / 2)
+        queue.enqueue_at(datetime.datetime.fromtimestamp(retry_at, datetime.timezone.utc),
+                         send_scores_job, url, game_results, attempt, enqueued_at)
+        r.hincrby(METRICS_KEY, "deferred", 1)
+        return "deferred, circuit open"
+
+    try:
+        response = httpx.post(url, json=game_results, timeout=DELIVERY_TIMEOUT_SECONDS)
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        if 400 <= e.response.status_code < 500 and e.response.status_code not in (408, 429):
+            # the subscriber is up but rejects this delivery, retrying won't help
+            return _dead_letter(r, url, game_results, attempt, str(e))
+        return _retry(r, queue, url, game_results, attempt, enqueued_at, str(e))
+    except httpx.HTTPError as e:
+        return _retry(r, queue, url, game_results, attempt, enqueued_at, str(e))
+
+    _record_success(r, url)
+    r.hincrby(METRICS_KEY, "delivered", 1)
+    return response.status_code
+
+
+def _retry(r, queue, url, game_results, attempt, enqueued_at, error):
+    _record_failure(r, url)
+    if attempt >= MAX_ATTEMPTS or time.time() - enqueued_at > MAX_AGE_SECONDS:
+        return _dead_letter(r, url, game_results, attempt, error)
+
+    delay = _backoff(attempt)
+    queue.enqueue_in(datetime.timedelta(seconds=delay), send_scores_job, url, game_results, attempt + 1, enqueued_at)
+    r.hincrby(METRICS_KEY, "retried", 1)
+    return f"attempt {attempt} failed, retrying in {delay:.1f}s"
+
+
+def _dead_letter(r, url, game_results, attempt, error):
+    r.rpush(DEAD_LETTER_KEY, json.dumps({
+        "url": url, "game_results": game_results, "attempts": attempt, "error": error, "failed_at": time.time()
+    }))
+    r.hincrby(METRICS_KEY, "dead_lettered", 1)
+    return f"dead lettered after {attempt} attempts"
+
+
+# Full jitter: a random delay up to the exponential backoff, so retries of a burst don't arrive together
+def _backoff(attempt):
+    return random.uniform(0, min(MAX_DELAY_SECONDS, BASE_DELAY_SECONDS * 2 ** (attempt - 1)))
+
+
+def _circuit_open_until(r, url):
+    open_until = r.hget(CIRCUIT_KEY + url, "open_until")
+    if open_until is not None and float(open_until) > time.time():
+        return float(open_until)
+    return None
+
+
+def _record_failure(r, url):
+    r.hincrby(METRICS_KEY, "failed", 1)
+    failures = r.hincrby(CIRCUIT_KEY + url, "failures", 1)
+    if failures >= CIRCUIT_FAILURE_THRESHOLD:
+        r.hset(CIRCUIT_KEY + url, "open_until", time.time() + CIRCUIT_OPEN_SECONDS)
+
+
+def _record_success(r, url):
+    r.delete(CIRCUIT_KEY + url)
+
+
+def delivery_metrics(r=None):
+    r = r or Redis()
+    queue = rq.Queue(connection=r)
+    metrics = {key.decode("UTF-8"): int(value) for key, value in r.hgetall(METRICS_KEY).items()}
+    for counter in ("delivered", "failed", "retried", "deferred", "dead_lettered"):
+        metrics.setdefault(counter, 0)
+
+    open_circuits = []
+    for key in r.scan_iter(match=CIRCUIT_KEY + "*"):
+        url = key.decode("UTF-8")[len(CIRCUIT_KEY):]
+        if _circuit_open_until(r, url):
+            open_circuits.append(url)
+
+    metrics.update({
+        "queued": queue.count,
+        "scheduled": queue.scheduled_job_registry.count,
+        "dead_letter": r.llen(DEAD_LETTER_KEY),
+        "open_circuits": open_circuits,
+    })
+    return metrics